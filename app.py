@@ -4,33 +4,60 @@ eventlet.monkey_patch()  # Must be the first import
 import os
 import sqlite3
 import logging
+import logging.handlers
+import atexit
 import asyncio
 from datetime import datetime
 import datetime as dt
-from flask import Flask, request, render_template, jsonify
-from flask_socketio import SocketIO, join_room, emit
+from flask import Flask, request, render_template, jsonify, g, Response
+from flask_socketio import SocketIO, join_room, leave_room, emit
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, ChosenInlineResultHandler, ContextTypes
 from telegram.error import TelegramError
 from dotenv import load_dotenv
 import uuid
 import json
+import random
+import hashlib
 import requests
 from functools import wraps
 import time
 import signal
 import sys
+import threading
+import bisect
+import traceback
+from collections import deque, Counter, OrderedDict
 from sqlite3 import Error
 import retrying
+from chain_common import StructuredFormatter, EventRateLimitFilter, NonBlockingQueueHandler
+from chain_common import INLINE_CACHE_TIME, InlineAnswerCache, build_inline_results
 
 # Load environment variables
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 WEBHOOK_URL = "https://crypto-king-v2.onrender.com/webhook"
 
-# Set up logging with GMT+5:30 timezone
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logging.Formatter.converter = lambda *args: dt.datetime.now(dt.timezone(dt.timedelta(hours=5, minutes=30))).timetuple()
+# Logging pipeline settings
+LOG_TIMEZONE = dt.timezone(dt.timedelta(hours=5, minutes=30))  # GMT+5:30
+LOG_QUEUE_SIZE = 10000  # records buffered for the writer thread before new ones are dropped
+LOG_RATE_LIMITS = {"join": 20, "watch": 20, "move": 50, "connect": 20, "disconnect": 20}  # records per second
+
+# Drains the queue on a native OS thread so disk writes never stall the eventlet hub
+class LogWriter(logging.handlers.QueueListener):
+    def start(self):
+        self._thread = eventlet.patcher.original('threading').Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+
+log_queue = eventlet.patcher.original('queue').Queue(LOG_QUEUE_SIZE)
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(StructuredFormatter(LOG_TIMEZONE))
+log_writer = LogWriter(log_queue, log_stream_handler, respect_handler_level=True)
+log_queue_handler = NonBlockingQueueHandler(log_queue, eventlet.patcher.original('queue').Full)
+log_queue_handler.addFilter(EventRateLimitFilter(LOG_RATE_LIMITS))
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+log_writer.start()
+atexit.register(log_writer.stop)
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app and SocketIO
@@ -38,9 +65,181 @@ app = Flask(__name__, template_folder='templates', static_folder=None)
 app.config['SECRET_KEY'] = 'your-secret-key'
 socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=10, ping_interval=5, reconnection=True, reconnection_attempts=3)
 
+# Outbound broadcast limits per Socket.IO client
+BROADCAST_WINDOW = 2          # unacknowledged messages in flight per client
+BROADCAST_MAX_QUEUE = 32      # queued messages before a client is resynced
+BROADCAST_STALL_TIMEOUT = 15  # seconds without an ack before a client is dropped
+SPECTATOR_FPS = 4  # state frames per second pushed to each room's spectators
+
+# Metrics and profiling switches
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "1"
+PROFILE_INTERVAL = 0.005  # seconds between profiler samples
+
 # Rate limiting dictionary
 RATE_LIMIT = 1  # 1 request per second per user
 last_request = {}
+MAX_BATCH_MOVES = 500  # moves accepted by a single /make_moves request
+
+# Board dimensions and player cap, configurable per room
+DEFAULT_BOARD_ROWS = 6
+DEFAULT_BOARD_COLS = 9
+MIN_BOARD_SIZE = 3
+MAX_BOARD_SIZE = 30
+DEFAULT_MAX_PLAYERS = 8  # Increased to match BuddyMattEnt game; the client has colours for 8
+CASCADE_LIMIT_PER_CELL = 64  # explosions per board cell after which a cascade is cut off
+
+# Zobrist state hashing
+ZOBRIST_SEED = "chain-reaction"  # fixed so hashes survive restarts and match across workers
+RECENT_MOVES = 16  # applied moves remembered per room for retry deduplication
+
+# Metrics: counters, histograms and gauges rendered in Prometheus text format
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Metrics:
+    TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+    COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}  # (name, labels) -> [bucket bounds, bucket counts, sum, count]
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [buckets, [0] * len(buckets), 0, 0]
+            idx = bisect.bisect_left(hist[0], value)
+            if idx < len(hist[1]):
+                hist[1][idx] += 1
+            hist[2] += value
+            hist[3] += 1
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(((k, [v[0], list(v[1]), v[2], v[3]]) for k, v in self.histograms.items()), key=lambda item: item[0])
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (bounds, counts, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logger.error(f"Failed to read gauge {name}: {e}")
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+# Opt-in sampling profiler for a single request, driven by SIGPROF. The timer and
+# signal handler are process-wide, so only one profile may run at a time; samples
+# can still include other greenlets that run while the profiled request yields.
+class SamplingProfiler:
+    active = threading.Lock()
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.previous_handler = None
+
+    def _sample(self, signum, frame):
+        stack = traceback.extract_stack(frame)
+        self.samples[";".join(f"{f.name} ({os.path.basename(f.filename)}:{f.lineno})" for f in stack)] += 1
+
+    # Returns False when another profile is already running
+    def start(self):
+        if not SamplingProfiler.active.acquire(blocking=False):
+            return False
+        self.previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+        SamplingProfiler.active.release()
+        return self.samples
+
+# Database connections that time queries and commits when metrics are enabled
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        with metrics.timer("db_query_duration_seconds"):
+            return super().execute(sql, parameters)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        with metrics.timer("db_commit_duration_seconds"):
+            return super().commit()
 
 # Database connection pool
 class DatabasePool:
@@ -50,7 +249,10 @@ class DatabasePool:
 
     def connect(self):
         try:
-            self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+            if metrics.enabled:
+                self.connection = sqlite3.connect(self.db_file, check_same_thread=False, factory=InstrumentedConnection)
+            else:
+                self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
             self.connection.row_factory = sqlite3.Row
             return self.connection
         except Error as e:
@@ -84,8 +286,18 @@ def init_db():
             current_turn TEXT,
             status TEXT,
             created_at TIMESTAMP,
-            winner INTEGER
+            winner INTEGER,
+            board_rows INTEGER DEFAULT 6,
+            board_cols INTEGER DEFAULT 9,
+            max_players INTEGER DEFAULT 8,
+            move_count INTEGER
         )''')
+        # Databases created before board sizes were configurable or move counts were stored lack these columns
+        c.execute("PRAGMA table_info(games)")
+        columns = {column[1] for column in c.fetchall()}
+        for column in ("board_rows INTEGER DEFAULT 6", "board_cols INTEGER DEFAULT 9", "max_players INTEGER DEFAULT 8", "move_count INTEGER"):
+            if column.split()[0] not in columns:
+                c.execute(f"ALTER TABLE games ADD COLUMN {column}")
         conn.commit()
         logger.info("Database initialized successfully")
     except Exception as e:
@@ -96,38 +308,128 @@ def init_db():
 
 init_db()
 
+# Rate limiting: returns an error response when the user must wait, otherwise None
+def check_rate_limit(user_id):
+    if not user_id:
+        return jsonify({"error": "Missing user_id"}), 400
+
+    current_time = time.time()
+    if user_id in last_request:
+        if current_time - last_request[user_id] < RATE_LIMIT:
+            return jsonify({"error": "Rate limit exceeded. Please wait."}), 429
+    last_request[user_id] = current_time
+    return None
+
 # Rate limiting decorator
 def rate_limit(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user_id = request.args.get('user_id')
-        if not user_id:
-            return jsonify({"error": "Missing user_id"}), 400
-
-        current_time = time.time()
-        if user_id in last_request:
-            if current_time - last_request[user_id] < RATE_LIMIT:
-                return jsonify({"error": "Rate limit exceeded. Please wait."}), 429
-        last_request[user_id] = current_time
+        limited = check_rate_limit(request.args.get('user_id'))
+        if limited:
+            return limited
         return f(*args, **kwargs)
     return decorated_function
 
+# Zobrist keys: one random 64-bit key per (cell, cell value) and per turn slot,
+# extended lazily from seeded generators so any board size hashes deterministically
+class ZobristTable:
+    CELL_VALUES = 100  # cell value = owner * 10 + atoms
+
+    def __init__(self, seed):
+        self.cell_rng = random.Random(f"{seed}:cells")
+        self.turn_rng = random.Random(f"{seed}:turns")
+        self.cells = []
+        self.turns = []
+
+    def ensure_cells(self, count):
+        while len(self.cells) < count:
+            keys = [self.cell_rng.getrandbits(64) for _ in range(self.CELL_VALUES)]
+            keys[0] = 0  # empty cells do not contribute
+            self.cells.append(keys)
+
+    def turn_key(self, slot):
+        while len(self.turns) <= slot:
+            self.turns.append(self.turn_rng.getrandbits(64))
+        return self.turns[slot]
+
+    @staticmethod
+    def player_key(slot, player_id):
+        digest = hashlib.blake2b(f"{slot}:{player_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+ZOBRIST = ZobristTable(ZOBRIST_SEED)
+
 # Chain Reaction Game Logic
+NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
 class ChainReactionGame:
-    def __init__(self, room_id, host_id, host_username, board=None):
+    def __init__(self, room_id, host_id, host_username, board=None, rows=DEFAULT_BOARD_ROWS, cols=DEFAULT_BOARD_COLS, max_players=DEFAULT_MAX_PLAYERS):
         self.room_id = room_id
         self.players = [host_id]
         self.usernames = [host_username]
-        self.board = board if board else [[0 for _ in range(9)] for _ in range(6)]
+        self.board = board if board else [[0 for _ in range(cols)] for _ in range(rows)]
+        self.rows = len(self.board)
+        self.cols = len(self.board[0])
         self.current_turn = host_id
         self.status = "not_started"
         self.winner = None
         self.callbacks = {"game_status_change": [], "destroy": [], "chain_reaction": []}
-        self.max_players = 8  # Increased to match BuddyMattEnt game
+        self.max_players = max_players
+        self.move_count = 0
+        self.cascade_depth = 0
+        self.recent_moves = OrderedDict()  # state hash before a move -> (player_id, row, col)
+        self.journal = None  # (row, col, previous value) for every cell write while a batch is applied
+        self.rehash()
+
+    # Recomputes the Zobrist hash and per-player cell counts from scratch;
+    # needed after fields are assigned directly
+    def rehash(self):
+        ZOBRIST.ensure_cells(self.rows * self.cols)
+        self.cell_counts = [0] * (self.max_players + 1)
+        self.occupied_cells = 0
+        h = 0
+        for r, cells in enumerate(self.board):
+            for c, value in enumerate(cells):
+                h ^= ZOBRIST.cells[r * self.cols + c][value]
+                if value:
+                    self.cell_counts[value // 10] += 1
+                    self.occupied_cells += 1
+        for slot, player_id in enumerate(self.players):
+            h ^= ZobristTable.player_key(slot, player_id)
+        if self.current_turn in self.players:
+            h ^= ZOBRIST.turn_key(self.players.index(self.current_turn))
+        self.zobrist = h
+
+    def state_hash(self):
+        return format(self.zobrist, "016x")
+
+    # True when the same player already applied this move from this state (a client retry)
+    def is_duplicate_move(self, state_hash, player_id, row, col):
+        return self.recent_moves.get(state_hash) == (player_id, row, col)
+
+    # Every board write goes through here so the hash and cell counts stay O(1) to maintain
+    def _set_cell(self, row, col, value):
+        old = self.board[row][col]
+        keys = ZOBRIST.cells[row * self.cols + col]
+        self.zobrist ^= keys[old] ^ keys[value]
+        if old:
+            self.cell_counts[old // 10] -= 1
+            self.occupied_cells -= 1
+        if value:
+            self.cell_counts[value // 10] += 1
+            self.occupied_cells += 1
+        if self.journal is not None:
+            self.journal.append((row, col, old))
+        self.board[row][col] = value
+
+    def _critical_mass(self, row, col):
+        edges = (row == 0 or row == self.rows - 1) + (col == 0 or col == self.cols - 1)
+        return 4 - edges
 
     def add_player(self, player_id, username):
         if len(self.players) >= self.max_players or player_id in self.players:
             return False
+        self.zobrist ^= ZobristTable.player_key(len(self.players), player_id)
         self.players.append(player_id)
         self.usernames.append(username)
         if len(self.players) >= 2 and self.status == "not_started":
@@ -136,38 +438,76 @@ class ChainReactionGame:
         return True
 
     def make_move(self, player_id, row, col):
-        if self.status != "in_progress" or player_id != self.current_turn:
+        chain_reactions = self._apply_move(player_id, row, col)
+        if chain_reactions is None:
             return False
+        if self.status == "finished":
+            self._update_wins(self.players[self.winner - 1])
+
+        self._trigger_callback("game_status_change")
+        if chain_reactions:
+            self._trigger_callback("chain_reaction", chain_reactions)
+        return True
+
+    # Applies an ordered batch of (player_id, row, col) moves all-or-nothing and
+    # fires callbacks once. Returns the index of the first rejected move, or None.
+    def apply_moves(self, moves):
+        snapshot = (self.current_turn, self.status, self.winner, self.move_count, self.zobrist, OrderedDict(self.recent_moves))
+        self.journal = []
+        chain_reactions = []
+        try:
+            for index, (player_id, row, col) in enumerate(moves):
+                move_reactions = self._apply_move(player_id, row, col)
+                if move_reactions is None:
+                    # Undo only the cells this batch touched
+                    journal, self.journal = self.journal, None
+                    for r, c, value in reversed(journal):
+                        self._set_cell(r, c, value)
+                    self.current_turn, self.status, self.winner, self.move_count, self.zobrist, self.recent_moves = snapshot
+                    return index
+                chain_reactions.extend(move_reactions)
+        finally:
+            self.journal = None
+        if self.status == "finished":
+            self._update_wins(self.players[self.winner - 1])
+
+        self._trigger_callback("game_status_change")
+        if chain_reactions:
+            self._trigger_callback("chain_reaction", chain_reactions)
+        return None
+
+    def _apply_move(self, player_id, row, col):
+        if self.status != "in_progress" or player_id != self.current_turn:
+            return None
 
         player = self.players.index(player_id) + 1
-        if not (0 <= row < 6 and 0 <= col < 9):
-            return False
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return None
 
-        self.board[row][col] = (self.board[row][col] % 10) + (10 * player) + 1
+        self.recent_moves[self.state_hash()] = (player_id, row, col)
+        if len(self.recent_moves) > RECENT_MOVES:
+            self.recent_moves.popitem(last=False)
+        self._set_cell(row, col, (self.board[row][col] % 10) + (10 * player) + 1)
+        self.move_count += 1
+        self.cascade_depth = 0
         chain_reactions = self._process_chain_reaction(row, col, player)
+        metrics.observe("move_explosions", len(chain_reactions), buckets=Metrics.COUNT_BUCKETS)
+        metrics.observe("move_cascade_depth", self.cascade_depth, buckets=Metrics.COUNT_BUCKETS)
 
-        scores = [0] * len(self.players)
-        for p in range(len(self.players)):
-            scores[p] = sum(1 for r in range(6) for c in range(9) if self.board[r][c] > 0 and self.board[r][c] // 10 == (p + 1))
-
-        active_players = sum(1 for score in scores if score > 0)
-        if active_players <= 1 and len(self.players) > 1:
-            self.status = "finished"
-            for p in range(len(self.players)):
-                if scores[p] > 0:
-                    self.winner = p + 1
-                    self._update_wins(self.players[p])
-                    break
+        # Nobody can be eliminated before every player has placed at least once
+        if len(self.players) > 1 and self.move_count >= len(self.players):
+            active = [p for p in range(1, len(self.players) + 1) if self.cell_counts[p] > 0]
+            if len(active) <= 1:
+                self.status = "finished"
+                if active:
+                    self.winner = active[0]
 
         if self.status == "in_progress":
             current_idx = self.players.index(player_id)
             next_idx = (current_idx + 1) % len(self.players)
             self.current_turn = self.players[next_idx]
-
-        self._trigger_callback("game_status_change")
-        if chain_reactions:
-            self._trigger_callback("chain_reaction", chain_reactions)
-        return True
+            self.zobrist ^= ZOBRIST.turn_key(current_idx) ^ ZOBRIST.turn_key(next_idx)
+        return chain_reactions
 
     def _update_wins(self, winner_id):
         conn = db_pool.connect()
@@ -180,28 +520,45 @@ class ChainReactionGame:
         finally:
             conn.close()
 
+    # Depth-first cascade driven by an explicit stack, so large boards are not bound
+    # by the recursion limit and the cost is proportional to the explosions that happen.
+    # Random play stays under 8 explosions per cell; the hard limit keeps a corrupt
+    # state from cascading forever and stalling the event loop.
     def _process_chain_reaction(self, row, col, player):
         reactions = []
-        rows, cols = 6, 9
-        critical_mass = 4
-        if (row == 0 or row == rows - 1) and (col == 0 or col == cols - 1):
-            critical_mass = 2
-        elif row == 0 or row == rows - 1 or col == 0 or col == cols - 1:
-            critical_mass = 3
-
-        atoms = self.board[row][col] % 10
-        if atoms < critical_mass:
+        if not self._explode(row, col, player, 1, reactions):
             return reactions
+        limit = CASCADE_LIMIT_PER_CELL * self.rows * self.cols
+        stack = [[row, col, 0, 1]]  # row, col, next neighbour, depth
+        while stack:
+            if len(reactions) >= limit:
+                metrics.inc("cascade_limit_hits_total")
+                logger.warning("Cascade in room %s cut off after %d explosions", self.room_id, len(reactions))
+                break
+            frame = stack[-1]
+            r, c, direction, depth = frame
+            if direction == len(NEIGHBOURS):
+                stack.pop()
+                continue
+            frame[2] = direction + 1
+            dr, dc = NEIGHBOURS[direction]
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < self.rows and 0 <= nc < self.cols:
+                self._set_cell(nr, nc, (self.board[nr][nc] % 10) + (10 * player) + 1)
+                if self._explode(nr, nc, player, depth + 1, reactions):
+                    stack.append([nr, nc, 0, depth + 1])
+        return reactions
 
+    def _explode(self, row, col, player, depth, reactions):
+        if self.board[row][col] % 10 < self._critical_mass(row, col):
+            return False
+        # Once the mover owns every occupied cell the game is won and the cascade stops
+        if self.move_count >= len(self.players) and self.cell_counts[player] == self.occupied_cells:
+            return False
         reactions.append({"row": row, "col": col, "player": player})
-        self.board[row][col] = 0
-        for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            nr, nc = row + dr, col + dc
-            if 0 <= nr < rows and 0 <= nc < cols:
-                self.board[nr][nc] = (self.board[nr][nc] % 10) + (10 * player) + 1
-                sub_reactions = self._process_chain_reaction(nr, nc, player)
-                reactions.extend(sub_reactions)
-        return reactions
+        self.cascade_depth = max(self.cascade_depth, depth)
+        self._set_cell(row, col, 0)
+        return True
 
     def on(self, event, callback):
         if event in self.callbacks:
@@ -219,7 +576,11 @@ class ChainReactionGame:
             "board": self.board,
             "current_turn": self.current_turn,
             "status": self.status,
-            "winner": self.winner
+            "winner": self.winner,
+            "state_hash": self.state_hash(),
+            "rows": self.rows,
+            "cols": self.cols,
+            "max_players": self.max_players
         }
 
 # Game Server to Manage Rooms
@@ -227,16 +588,16 @@ class GameServer:
     def __init__(self):
         self.rooms = {}
 
-    def create_room(self, host_id, host_username):
+    def create_room(self, host_id, host_username, rows=DEFAULT_BOARD_ROWS, cols=DEFAULT_BOARD_COLS, max_players=DEFAULT_MAX_PLAYERS):
         room_id = str(uuid.uuid4())
-        game = ChainReactionGame(room_id, host_id, host_username)
-        self.rooms[room_id] = game
+        game = ChainReactionGame(room_id, host_id, host_username, rows=rows, cols=cols, max_players=max_players)
+        self.add_room(game)
 
         conn = db_pool.connect()
         try:
             c = conn.cursor()
-            c.execute("INSERT INTO games (room_id, players, usernames, board, current_turn, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                      (room_id, json.dumps([host_id]), json.dumps([host_username]), json.dumps(game.board), host_id, "not_started", datetime.now().isoformat()))
+            c.execute("INSERT INTO games (room_id, players, usernames, board, current_turn, status, created_at, board_rows, board_cols, max_players, move_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                      (room_id, json.dumps([host_id]), json.dumps([host_username]), json.dumps(game.board), host_id, "not_started", datetime.now().isoformat(), rows, cols, max_players, 0))
             c.execute("UPDATE users SET last_room_id = ? WHERE user_id = ?", (room_id, host_id))
             conn.commit()
         except Exception as e:
@@ -246,18 +607,326 @@ class GameServer:
             conn.close()
         return game
 
+    # Restores a room from the database; returns None when it does not exist
+    def load_room(self, room_id):
+        conn = db_pool.connect()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT * FROM games WHERE room_id = ?", (room_id,))
+            game_row = c.fetchone()
+        finally:
+            conn.close()
+        if not game_row:
+            return None
+        players = json.loads(game_row["players"])
+        usernames = json.loads(game_row["usernames"])
+        board = json.loads(game_row["board"])
+        rows = game_row["board_rows"] or DEFAULT_BOARD_ROWS
+        cols = game_row["board_cols"] or DEFAULT_BOARD_COLS
+        if len(board) != rows or any(len(cells) != cols for cells in board):
+            raise ValueError(f"Stored board for {room_id} does not match its {rows}x{cols} dimensions")
+        game = ChainReactionGame(
+            room_id=game_row["room_id"],
+            host_id=players[0],
+            host_username=usernames[0],
+            board=board,
+            rows=rows,
+            cols=cols,
+            max_players=game_row["max_players"] or DEFAULT_MAX_PLAYERS
+        )
+        game.players = players
+        game.usernames = usernames
+        game.current_turn = game_row["current_turn"]
+        game.status = game_row["status"]
+        game.winner = game_row["winner"]
+        game.move_count = game_row["move_count"]
+        if game.move_count is None:
+            # Rows saved before move counts were stored: assume everyone has placed once atoms are on the board
+            game.move_count = len(players) if any(any(cells) for cells in game.board) else 0
+        self.add_room(game)
+        return game
+
+    def save_game(self, game):
+        conn = db_pool.connect()
+        try:
+            c = conn.cursor()
+            c.execute("UPDATE games SET board = ?, current_turn = ?, status = ?, winner = ?, move_count = ? WHERE room_id = ?",
+                      (json.dumps(game.board), game.current_turn, game.status, game.winner, game.move_count, game.room_id))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to update game {game.room_id} in database: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def add_room(self, game):
+        # Rooms restored from the database get their fields assigned after construction
+        game.rehash()
+        self.rooms[game.room_id] = game
+        game.on("chain_reaction", lambda reactions: broadcaster.emit_room('chain_reaction', reactions, game.room_id))
+        game.on("game_status_change", lambda data: spectators.mark_dirty(game.room_id))
+
     def get_room(self, room_id):
         return self.rooms.get(room_id)
 
+# Outbound broadcast layer: bounded per-client queues with latest-state coalescing
+class ClientChannel:
+    def __init__(self, sid):
+        self.sid = sid
+        self.rooms = set()
+        self.queue = deque()
+        self.pending = {}  # coalescing key -> queued [event, data, key, size] entry
+        self.sent_at = deque()  # send times of unacknowledged messages
+
+class Broadcaster:
+    def __init__(self, sio, window=BROADCAST_WINDOW, max_queue=BROADCAST_MAX_QUEUE, stall_timeout=BROADCAST_STALL_TIMEOUT):
+        self.socketio = sio
+        self.window = window
+        self.max_queue = max_queue
+        self.stall_timeout = stall_timeout
+        self.channels = {}
+        self.rooms = {}
+        self.lock = threading.Lock()
+        self.stats = {"sent": 0, "coalesced": 0, "dropped": 0, "resyncs": 0, "disconnects": 0}
+
+    def subscribe(self, sid, room_id):
+        with self.lock:
+            channel = self.channels.get(sid)
+            if not channel:
+                channel = self.channels[sid] = ClientChannel(sid)
+            channel.rooms.add(room_id)
+            self.rooms.setdefault(room_id, set()).add(sid)
+
+    def unsubscribe(self, sid):
+        with self.lock:
+            channel = self.channels.pop(sid, None)
+            if not channel:
+                return
+            for room_id in channel.rooms:
+                members = self.rooms.get(room_id)
+                if members:
+                    members.discard(sid)
+                    if not members:
+                        del self.rooms[room_id]
+
+    # coalesce=True marks events that carry the full room state (game_start, game_update);
+    # they share one key per room so only the newest of them is ever queued
+    def emit_room(self, event, data, room_id, coalesce=False):
+        key = self.state_key(room_id) if coalesce else None
+        with self.lock:
+            sids = list(self.rooms.get(room_id, ()))
+        if not sids:
+            return
+        size = self._payload_size(data)
+        for sid in sids:
+            self._send(sid, event, data, key, size)
+
+    def emit_client(self, sid, event, data, key=None):
+        self._send(sid, event, data, key, self._payload_size(data))
+
+    # Payload size for the emit metrics, measured once per broadcast rather than per recipient
+    @staticmethod
+    def _payload_size(data):
+        return len(json.dumps(data)) if metrics.enabled else 0
+
+    @staticmethod
+    def state_key(room_id):
+        return ('state', room_id)
+
+    def queue_depth(self):
+        with self.lock:
+            depths = [len(channel.queue) for channel in self.channels.values()]
+            return {
+                "clients": len(depths),
+                "total": sum(depths),
+                "max": max(depths, default=0),
+                **self.stats
+            }
+
+    def _send(self, sid, event, data, key, size):
+        with self.lock:
+            channel = self.channels.get(sid)
+            if not channel:
+                return
+            stalled = channel.sent_at and time.time() - channel.sent_at[0] > self.stall_timeout
+            if not stalled:
+                self._enqueue(channel, event, data, key, size)
+                metrics.inc("socketio_enqueued_total", event=event)
+                stalled = len(channel.queue) > self.max_queue
+        if stalled:
+            self._disconnect(sid)
+        else:
+            self._drain(sid)
+
+    def _enqueue(self, channel, event, data, key, size):
+        if key is not None and key in channel.pending:
+            # Latest state wins: drop the stale state and queue the new one behind
+            # the events that preceded it, so animations stay in order
+            channel.queue.remove(channel.pending.pop(key))
+            self.stats["coalesced"] += 1
+        entry = [event, data, key, size]
+        channel.queue.append(entry)
+        if key is not None:
+            channel.pending[key] = entry
+        if len(channel.queue) > self.max_queue:
+            # Too far behind: keep only the latest room states and drop transient events
+            kept = deque(e for e in channel.queue if e[2] is not None)
+            self.stats["dropped"] += len(channel.queue) - len(kept)
+            self.stats["resyncs"] += 1
+            channel.queue = kept
+            logger.warning("Client %s fell behind, resynced to %d queued states", channel.sid, len(kept))
+
+    def _drain(self, sid):
+        while True:
+            with self.lock:
+                channel = self.channels.get(sid)
+                if not channel or not channel.queue or len(channel.sent_at) >= self.window:
+                    return
+                event, data, key, size = channel.queue.popleft()
+                if key is not None:
+                    channel.pending.pop(key, None)
+                channel.sent_at.append(time.time())
+                self.stats["sent"] += 1
+            if metrics.enabled:
+                metrics.inc("socketio_emits_total", event=event)
+                metrics.observe("socketio_emit_bytes", size, buckets=Metrics.SIZE_BUCKETS, event=event)
+            # Emit through the python-socketio server so the ack callback is used as is; Flask-SocketIO
+            # would bind it to the request context of whichever client triggered this send
+            self.socketio.server.emit(event, data, to=sid, namespace='/', callback=lambda *args: self._on_ack(sid))
+
+    def _on_ack(self, sid):
+        with self.lock:
+            channel = self.channels.get(sid)
+            if not channel or not channel.sent_at:
+                return
+            channel.sent_at.popleft()
+        self._drain(sid)
+
+    def _disconnect(self, sid):
+        self.unsubscribe(sid)
+        with self.lock:
+            self.stats["disconnects"] += 1
+        logger.warning("Disconnecting client %s: outbound queue stalled", sid)
+        try:
+            self.socketio.server.disconnect(sid)
+        except Exception as e:
+            logger.error(f"Failed to disconnect client {sid}: {e}")
+
+broadcaster = Broadcaster(socketio)
+
+# Read-only spectator tier: spectators share a Socket.IO room per game and receive
+# at most SPECTATOR_FPS frames per second, each built once per tick and sent with a
+# single room emit
+class SpectatorHub:
+    def __init__(self, sio, fps=SPECTATOR_FPS):
+        self.socketio = sio
+        self.interval = 1.0 / fps
+        self.rooms = {}  # room_id -> spectator sids
+        self.watching = {}  # sid -> room_id
+        self.dirty = set()
+        self.running = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def channel(room_id):
+        return f"{room_id}:spectators"
+
+    # Returns the room the sid was watching before, so the caller can leave its channel
+    def add(self, sid, room_id):
+        previous = self.remove(sid)
+        with self.lock:
+            self.rooms.setdefault(room_id, set()).add(sid)
+            self.watching[sid] = room_id
+            start = not self.running
+            self.running = True
+        if start:
+            self.socketio.start_background_task(self._run)
+        return previous
+
+    def remove(self, sid):
+        with self.lock:
+            room_id = self.watching.pop(sid, None)
+            members = self.rooms.get(room_id)
+            if members:
+                members.discard(sid)
+                if not members:
+                    del self.rooms[room_id]
+        return room_id
+
+    def mark_dirty(self, room_id):
+        with self.lock:
+            if room_id in self.rooms:
+                self.dirty.add(room_id)
+
+    def count(self):
+        with self.lock:
+            return len(self.watching)
+
+    # One tick per interval: every room that changed since the last tick gets a single frame
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            with self.lock:
+                if not self.rooms:
+                    self.running = False
+                    return
+                dirty, self.dirty = self.dirty, set()
+            for room_id in dirty:
+                game = game_server.get_room(room_id)
+                if not game:
+                    continue
+                metrics.inc("spectator_frames_total")
+                self.socketio.emit('spectator_update', game.to_dict(), to=self.channel(room_id))
+
+spectators = SpectatorHub(socketio)
+
 # Flask Routes
 game_server = GameServer()
 
+metrics.gauge("game_rooms", lambda: len(game_server.rooms))
+metrics.gauge("socketio_clients", lambda: broadcaster.queue_depth()["clients"])
+metrics.gauge("socketio_queue_depth", lambda: broadcaster.queue_depth()["total"])
+metrics.gauge("socketio_queue_depth_max", lambda: broadcaster.queue_depth()["max"])
+metrics.gauge("spectators", lambda: spectators.count())
+metrics.gauge("log_records_dropped", lambda: log_queue_handler.dropped)
+metrics.gauge("log_queue_depth", lambda: log_queue.qsize())
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get('profile') == '1':
+        profiler = SamplingProfiler()
+        if not profiler.start():
+            return jsonify({"error": "Another request is being profiled"}), 409
+        g.profiler = profiler
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        samples = profiler.stop()
+        logger.info("Profile for %s (%d samples):\n%s", request.path, sum(samples.values()),
+                    "\n".join(f"{stack} {count}" for stack, count in samples.most_common(20)))
+    if metrics.enabled and 'request_start' in g:
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - g.request_start,
+                        endpoint=request.endpoint or "unknown", method=request.method, status=response.status_code)
+    return response
+
+# after_request is skipped when a view raises; make sure the profiler is always stopped
+@app.teardown_request
+def stop_request_profiler(exc):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.stop()
+
 @app.route('/', methods=['GET'])
 def index():
     user_id = request.args.get('user_id')
     username = request.args.get('username', 'Unknown')
     room_id = request.args.get('room_id')
-    logger.info(f"Accessing / with user_id: {user_id}, username: {username}, room_id: {room_id}")
+    logger.info("Accessing / with user_id: %s, username: %s, room_id: %s", user_id, username, room_id,
+                extra={"event": "index", "user_id": user_id, "room_id": room_id})
 
     if not user_id:
         user_id = "test_user"
@@ -286,34 +955,16 @@ def index():
     game_data = None
     if room_id:
         game = game_server.get_room(room_id)
-        if game:
-            game_data = game.to_dict()
-        else:
-            conn = db_pool.connect()
+        if not game:
             try:
-                c = conn.cursor()
-                c.execute("SELECT * FROM games WHERE room_id = ?", (room_id,))
-                game_row = c.fetchone()
-                if game_row:
-                    game = ChainReactionGame(
-                        room_id=game_row[0],
-                        host_id=json.loads(game_row[1])[0],
-                        host_username=json.loads(game_row[2])[0],
-                        board=json.loads(game_row[3])
-                    )
-                    game.players = json.loads(game_row[1])
-                    game.usernames = json.loads(game_row[2])
-                    game.current_turn = game_row[4]
-                    game.status = game_row[5]
-                    game.winner = game_row[7]
-                    game_server.rooms[room_id] = game
-                    game_data = game.to_dict()
+                game = game_server.load_room(room_id)
             except Exception as e:
                 logger.error(f"Failed to load game {room_id} from database: {e}")
-            finally:
-                conn.close()
+        if game:
+            game_data = game.to_dict()
 
-    return render_template('index.html', user_id=user_id, username=username, room_id=room_id, game_data=game_data)
+    spectate = request.args.get('spectate') == '1'
+    return render_template('index.html', user_id=user_id, username=username, room_id=room_id, game_data=game_data, spectate=spectate)
 
 @app.route('/start_game', methods=['POST'])
 @rate_limit
@@ -322,15 +973,26 @@ def start_game():
     username = request.args.get('username')
     if not user_id or not username:
         return jsonify({"error": "Missing user_id or username"}), 400
-
-    game = game_server.create_room(user_id, username)
+    try:
+        rows = int(request.args.get('rows', DEFAULT_BOARD_ROWS))
+        cols = int(request.args.get('cols', DEFAULT_BOARD_COLS))
+        max_players = int(request.args.get('max_players', DEFAULT_MAX_PLAYERS))
+    except ValueError:
+        return jsonify({"error": "Invalid rows, cols or max_players"}), 400
+    if not (MIN_BOARD_SIZE <= rows <= MAX_BOARD_SIZE and MIN_BOARD_SIZE <= cols <= MAX_BOARD_SIZE):
+        return jsonify({"error": f"Board dimensions must be between {MIN_BOARD_SIZE} and {MAX_BOARD_SIZE}"}), 400
+    if not 2 <= max_players <= DEFAULT_MAX_PLAYERS:
+        return jsonify({"error": f"max_players must be between 2 and {DEFAULT_MAX_PLAYERS}"}), 400
+
+    game = game_server.create_room(user_id, username, rows, cols, max_players)
     if not game:
         return jsonify({"error": "Failed to create game"}), 500
     game_url = f"https://crypto-king-v2.onrender.com/?user_id={user_id}&username={username}&room_id={game.room_id}"
     return jsonify({"room_id": game.room_id, "game_url": game_url, "game_data": game.to_dict()})
 
+# Rate limited like the other POST routes, except that recognised retries are
+# answered first so a quick resend gets the idempotent reply instead of a 429
 @app.route('/make_move', methods=['POST'])
-@rate_limit
 def make_move():
     user_id = request.args.get('user_id')
     room_id = request.args.get('room_id')
@@ -347,23 +1009,72 @@ def make_move():
     if not game:
         return jsonify({"error": "Game not found"}), 404
 
+    # Clients send the state hash they saw: a retried move is answered with the
+    # current state, and a move made from a stale view is rejected for resync
+    state_hash = request.args.get('state_hash')
+    if state_hash and game.is_duplicate_move(state_hash, user_id, row, col):
+        metrics.inc("move_retries_total")
+        return jsonify(game.to_dict())
+
+    limited = check_rate_limit(user_id)
+    if limited:
+        return limited
+
+    if state_hash and state_hash != game.state_hash():
+        metrics.inc("move_state_conflicts_total")
+        return jsonify({"error": "Game state changed", "game_data": game.to_dict()}), 409
+
     if game.make_move(user_id, row, col):
-        conn = db_pool.connect()
-        try:
-            c = conn.cursor()
-            c.execute("UPDATE games SET board = ?, current_turn = ?, status = ?, winner = ? WHERE room_id = ?",
-                      (json.dumps(game.board), game.current_turn, game.status, game.winner, room_id))
-            conn.commit()
-        except Exception as e:
-            logger.error(f"Failed to update game {room_id} in database: {e}")
+        if not game_server.save_game(game):
             return jsonify({"error": "Database error"}), 500
-        finally:
-            conn.close()
-        socketio.emit('game_update', {"room_id": room_id, "game_data": game.to_dict()}, room=room_id)
+        logger.info("User %s moved to (%d, %d) in room %s", user_id, row, col, room_id,
+                    extra={"event": "move", "user_id": user_id, "room_id": room_id})
+        broadcaster.emit_room('game_update', {"room_id": room_id, "game_data": game.to_dict()}, room_id, coalesce=True)
         return jsonify(game.to_dict())
     else:
         return jsonify({"error": "Invalid move"}), 400
 
+# Batch move submission for replays, imported games, AI players and test harnesses.
+# Body: {"moves": [{"user_id": ..., "row": ..., "col": ...}, ...], "state_hash": optional}
+@app.route('/make_moves', methods=['POST'])
+@rate_limit
+def make_moves():
+    user_id = request.args.get('user_id')
+    room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('moves'), list):
+        return jsonify({"error": "Missing moves"}), 400
+    try:
+        moves = [(str(move['user_id']), int(move['row']), int(move['col'])) for move in payload['moves']]
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": "Invalid moves"}), 400
+    if not moves or len(moves) > MAX_BATCH_MOVES:
+        return jsonify({"error": f"Batch must contain 1 to {MAX_BATCH_MOVES} moves"}), 400
+
+    game = game_server.get_room(room_id)
+    if not game:
+        return jsonify({"error": "Game not found"}), 404
+
+    state_hash = payload.get('state_hash')
+    if state_hash and state_hash != game.state_hash():
+        metrics.inc("move_state_conflicts_total")
+        return jsonify({"error": "Game state changed", "game_data": game.to_dict()}), 409
+
+    rejected = game.apply_moves(moves)
+    if rejected is not None:
+        return jsonify({"error": "Invalid move", "index": rejected}), 400
+    if not game_server.save_game(game):
+        return jsonify({"error": "Database error"}), 500
+
+    metrics.observe("batch_moves", len(moves), buckets=Metrics.COUNT_BUCKETS)
+    logger.info("User %s applied %d moves in room %s", user_id, len(moves), room_id,
+                extra={"event": "move", "user_id": user_id, "room_id": room_id})
+    broadcaster.emit_room('game_update', {"room_id": room_id, "game_data": game.to_dict()}, room_id, coalesce=True)
+    return jsonify({**game.to_dict(), "applied": len(moves)})
+
 @app.route('/leaderboard', methods=['GET'])
 def leaderboard():
     conn = db_pool.connect()
@@ -385,11 +1096,17 @@ def health():
         c = conn.cursor()
         c.execute("SELECT 1")
         conn.close()
-        return jsonify({"status": "healthy", "message": "Application and database are running"})
+        return jsonify({"status": "healthy", "message": "Application and database are running", "broadcast": broadcaster.queue_depth()})
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         return jsonify({"status": "unhealthy", "message": str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/debug', methods=['GET'])
 def debug():
     return "Chain Reaction Game v1.0 - Flask is running!"
@@ -411,40 +1128,24 @@ def on_join_game(data):
     room_id = data['room_id']
     user_id = data['user_id']
     username = data['username']
-    logger.info(f"User {user_id} ({username}) attempting to join room {room_id}")
+    logger.info("User %s (%s) attempting to join room %s", user_id, username, room_id,
+                extra={"event": "join", "user_id": user_id, "room_id": room_id})
     join_room(room_id)
+    broadcaster.subscribe(request.sid, room_id)
 
     game = game_server.get_room(room_id)
     if not game:
         # Try to load from database
-        conn = db_pool.connect()
         try:
-            c = conn.cursor()
-            c.execute("SELECT * FROM games WHERE room_id = ?", (room_id,))
-            game_row = c.fetchone()
-            if game_row:
-                game = ChainReactionGame(
-                    room_id=game_row[0],
-                    host_id=json.loads(game_row[1])[0],
-                    host_username=json.loads(game_row[2])[0],
-                    board=json.loads(game_row[3])
-                )
-                game.players = json.loads(game_row[1])
-                game.usernames = json.loads(game_row[2])
-                game.current_turn = game_row[4]
-                game.status = game_row[5]
-                game.winner = game_row[7]
-                game_server.rooms[room_id] = game
-            else:
-                emit('join_error', {"error": "Game not found"}, to=user_id)
-                logger.error(f"Game {room_id} not found in database")
-                return
+            game = game_server.load_room(room_id)
         except Exception as e:
             logger.error(f"Failed to load game {room_id} from database: {e}")
             emit('join_error', {"error": "Database error"}, to=user_id)
             return
-        finally:
-            conn.close()
+        if not game:
+            emit('join_error', {"error": "Game not found"}, to=user_id)
+            logger.error(f"Game {room_id} not found in database")
+            return
 
     if game and game.add_player(user_id, username):
         conn = db_pool.connect()
@@ -461,29 +1162,57 @@ def on_join_game(data):
         finally:
             conn.close()
 
-        emit('game_start', game.to_dict(), room=room_id)
-        emit('player_joined', {"username": username}, room=room_id)
-        logger.info(f"User {user_id} ({username}) successfully joined room {room_id}")
+        broadcaster.emit_room('game_start', game.to_dict(), room_id, coalesce=True)
+        broadcaster.emit_room('player_joined', {"username": username}, room_id)
+        logger.info("User %s (%s) successfully joined room %s", user_id, username, room_id,
+                    extra={"event": "join", "user_id": user_id, "room_id": room_id})
     else:
         emit('join_error', {"error": "Unable to join game"}, to=user_id)
         logger.error(f"User {user_id} ({username}) failed to join room {room_id}")
 
+# Spectators get an initial snapshot, then throttled frames; they never become players
+@socketio.on('watch_game')
+def on_watch_game(data):
+    room_id = data.get('room_id')
+    logger.info("Client %s watching room %s", request.sid, room_id, extra={"event": "watch", "room_id": room_id})
+    game = game_server.get_room(room_id)
+    if not game:
+        try:
+            game = game_server.load_room(room_id)
+        except Exception as e:
+            logger.error(f"Failed to load game {room_id} from database: {e}")
+            emit('join_error', {"error": "Database error"})
+            return
+        if not game:
+            emit('join_error', {"error": "Game not found"})
+            return
+
+    previous = spectators.add(request.sid, room_id)
+    if previous and previous != room_id:
+        leave_room(SpectatorHub.channel(previous))
+    join_room(SpectatorHub.channel(room_id))
+    emit('spectator_update', game.to_dict())
+
+# Clients cannot push state; a game_update from a client is a resync request
+# answered with the authoritative server state unless its state_hash already matches.
+# Chain reactions are emitted by the server.
 @socketio.on('game_update')
 def on_game_update(data):
-    room_id = data['room_id']
-    emit('game_update', data, room=room_id)
-
-@socketio.on('chain_reaction')
-def on_chain_reaction(data):
-    emit('chain_reaction', data, room=data['room_id'])
+    room_id = data.get('room_id')
+    game = game_server.get_room(room_id)
+    if not game or data.get('state_hash') == game.state_hash():
+        return
+    broadcaster.emit_client(request.sid, 'game_update', {"room_id": room_id, "game_data": game.to_dict()}, key=Broadcaster.state_key(room_id))
 
 @socketio.on('connect')
 def on_connect():
-    logger.info(f"Client connected: {request.sid}")
+    logger.info("Client connected: %s", request.sid, extra={"event": "connect"})
 
 @socketio.on('disconnect')
 def on_disconnect():
-    logger.info(f"Client disconnected: {request.sid}")
+    broadcaster.unsubscribe(request.sid)
+    spectators.remove(request.sid)
+    logger.info("Client disconnected: %s", request.sid, extra={"event": "disconnect"})
 
 @socketio.on('connect_error')
 def on_connect_error(data):
@@ -513,60 +1242,56 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(
-        f"Welcome, {username}! 🎮\nStart a Chain Reaction game!",
-        reply_markup=reply_markup
-    )
-    logger.info(f"User {user_id} ({username}) started bot")
+    with metrics.timer("telegram_api_duration_seconds", method="send_message"):
+        await update.message.reply_text(
+            f"Welcome, {username}! 🎮\nStart a Chain Reaction game!",
+            reply_markup=reply_markup
+        )
+    logger.info("User %s (%s) started bot", user_id, username, extra={"event": "start", "user_id": user_id})
+
+# Cached answers also mean the users row is written at most once per TTL
+inline_cache = InlineAnswerCache()
 
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.inline_query.query
     user = update.inline_query.from_user
     user_id = str(user.id)
     username = user.username or user.first_name
     language_code = user.language_code or "en"
 
-    conn = db_pool.connect()
-    try:
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO users (user_id, username, full_name, language_code) VALUES (?, ?, ?, ?)",
-                  (user_id, username, f"{user.first_name} {user.last_name or ''}".strip(), language_code))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to upsert user {user_id} in database: {e}")
-    finally:
-        conn.close()
-
-    results = [
-        {
-            "type": "article",
-            "id": "create_game",
-            "title": "Start a Chain Reaction Game",
-            "description": "Play a 6x9 Chain Reaction game with friends!",
-            "input_message_content": {
-                "message_text": f"{username} is creating a Chain Reaction game...",
-                "parse_mode": "Markdown"
-            },
-            "reply_markup": {
-                "inline_keyboard": [[{"text": "Waiting...", "callback_data": "creating-room"}]]
-            }
-        }
-    ]
+    results = inline_cache.get(user_id, username)
+    if results is None:
+        metrics.inc("inline_cache_misses_total")
+        conn = db_pool.connect()
+        try:
+            c = conn.cursor()
+            c.execute("INSERT OR REPLACE INTO users (user_id, username, full_name, language_code) VALUES (?, ?, ?, ?)",
+                      (user_id, username, f"{user.first_name} {user.last_name or ''}".strip(), language_code))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to upsert user {user_id} in database: {e}")
+        finally:
+            conn.close()
+        results = build_inline_results(username)
+        inline_cache.put(user_id, username, results)
+    else:
+        metrics.inc("inline_cache_hits_total")
 
-    await update.inline_query.answer(results, cache_time=0)
+    with metrics.timer("telegram_api_duration_seconds", method="answer_inline_query"):
+        await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
 
 @retrying.retry(stop_max_attempt_number=3, wait_fixed=2000)
 async def update_inline_message(context, inline_message_id, message_text, reply_markup):
     try:
-        await context.bot.edit_message_text(
-            chat_id=None,
-            message_id=inline_message_id,
-            inline_message_id=inline_message_id,
-            text=message_text,
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
-        logger.info(f"Updated inline message {inline_message_id} with text: {message_text}")
+        with metrics.timer("telegram_api_duration_seconds", method="edit_message_text"):
+            await context.bot.edit_message_text(
+                chat_id=None,
+                message_id=inline_message_id,
+                inline_message_id=inline_message_id,
+                text=message_text,
+                parse_mode="Markdown",
+                reply_markup=reply_markup
+            )
+        logger.info("Updated inline message %s with text: %s", inline_message_id, message_text)
     except TelegramError as e:
         logger.error(f"Failed to update inline message {inline_message_id}: {e}")
         raise
@@ -590,7 +1315,8 @@ async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYP
             return
 
         game_url = f"https://crypto-king-v2.onrender.com/?user_id={user_id}&username={username}&room_id={game.room_id}"
-        logger.info(f"Created game for user {user_id} ({username}) with room_id {game.room_id}, URL: {game_url}")
+        logger.info("Created game for user %s (%s) with room_id %s, URL: %s", user_id, username, game.room_id, game_url,
+                    extra={"event": "create_game", "user_id": user_id, "room_id": game.room_id})
 
         message_text = f"{username} started a Chain Reaction game! Join now!"
         keyboard = [[InlineKeyboardButton("Join", web_app=WebAppInfo(url=game_url))]]
@@ -611,7 +1337,7 @@ async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYP
                 keyboard = [[InlineKeyboardButton("Join", web_app=WebAppInfo(url=game_url))]]
             elif game.status == "in_progress":
                 message_text = f"Chain Reaction game in progress: {', '.join(game.usernames)}"
-                keyboard = [[InlineKeyboardButton("Watch", web_app=WebAppInfo(url=game_url))]]
+                keyboard = [[InlineKeyboardButton("Watch", web_app=WebAppInfo(url=f"{game_url}&spectate=1"))]]
             elif game.status == "finished":
                 winner = game.usernames[game.winner - 1]
                 message_text = f"Game finished! {winner} wins!"
@@ -638,7 +1364,8 @@ async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYP
             except Exception as e:
                 logger.error(f"Failed to update inline message {inline_message_id} for status {game.status}: {e}")
 
-        game.on("game_status_change", lambda: asyncio.create_task(update_message()))
+        # Status changes fire on eventlet green threads with no running loop; hand the update to the bot loop
+        game.on("game_status_change", lambda data: asyncio.run_coroutine_threadsafe(update_message(), loop))
 
 # Initialize Telegram Bot with Webhooks
 bot_app = Application.builder().token(TELEGRAM_TOKEN).build()
@@ -650,8 +1377,9 @@ bot_app.add_handler(ChosenInlineResultHandler(chosen_inline_result))
 # Retry logic for setting webhook
 @retrying.retry(stop_max_attempt_number=3, wait_fixed=2000)
 async def set_webhook_with_retry():
-    await bot_app.bot.set_webhook(url=WEBHOOK_URL)
-    logger.info(f"Webhook set to {WEBHOOK_URL}")
+    with metrics.timer("telegram_api_duration_seconds", method="set_webhook"):
+        await bot_app.bot.set_webhook(url=WEBHOOK_URL)
+    logger.info("Webhook set to %s", WEBHOOK_URL)
 
 # Set webhook during app initialization
 async def initialize_webhook():
@@ -660,9 +1388,10 @@ async def initialize_webhook():
     except Exception as e:
         logger.error(f"Failed to set webhook after retries: {e}")
 
-# Run webhook setup
-loop = asyncio.get_event_loop()
+# Run webhook setup, then keep the bot loop running on a native thread for game status callbacks
+loop = asyncio.new_event_loop()
 loop.run_until_complete(initialize_webhook())
+eventlet.patcher.original('threading').Thread(target=loop.run_forever, name="bot-loop", daemon=True).start()
 
 # Graceful shutdown
 def shutdown_handler(signum, frame):
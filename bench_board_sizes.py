@@ -0,0 +1,35 @@
+# Benchmark: engine per-move latency as the board grows.
+# Usage: python bench_board_sizes.py [moves per size]
+import sys
+import time
+import random
+
+import app as server
+
+SIZES = [(6, 9), (10, 15), (15, 20), (20, 30), (30, 30)]
+
+# Random legal play, starting a fresh two-player game whenever one finishes
+def bench(rows, cols, moves, seed=0):
+    rng = random.Random(seed)
+    elapsed = 0.0
+    explosions = []
+    played = 0
+    while played < moves:
+        game = server.ChainReactionGame("bench", "bench_a", "Bench A", rows=rows, cols=cols)
+        game._update_wins = lambda winner_id: None  # keep the database out of the timing
+        game.add_player("bench_b", "Bench B")
+        game.on("chain_reaction", lambda reactions: explosions.append(len(reactions)))
+        while game.status == "in_progress" and played < moves:
+            row, col = rng.randrange(rows), rng.randrange(cols)
+            start = time.perf_counter()
+            game.make_move(game.current_turn, row, col)
+            elapsed += time.perf_counter() - start
+            played += 1
+    return elapsed / played, sum(explosions) / played
+
+if __name__ == "__main__":
+    moves = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print(f"{'board':>7} {'cells':>6} {'us/move':>9} {'explosions/move':>16}")
+    for rows, cols in SIZES:
+        per_move, explosions = bench(rows, cols, moves)
+        print(f"{rows:>3}x{cols:<3} {rows * cols:>6} {per_move * 1e6:>9.1f} {explosions:>16.1f}")
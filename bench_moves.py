@@ -0,0 +1,62 @@
+# Benchmark: one /make_moves batch vs the same moves as individual /make_move calls.
+# Usage: python bench_moves.py [games]
+import os
+import sys
+import time
+import random
+import tempfile
+
+import app as server
+
+# Route everything to a scratch database and lift the per-user rate limit
+server.db_pool.db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+server.init_db()
+server.RATE_LIMIT = 0
+client = server.app.test_client()
+
+PLAYERS = [("bench_a", "Bench A"), ("bench_b", "Bench B")]
+
+def new_game():
+    game = server.game_server.create_room(*PLAYERS[0])
+    game.add_player(*PLAYERS[1])
+    return game
+
+# Random legal play until the game ends or the batch limit is reached
+def random_moves(seed):
+    rng = random.Random(seed)
+    game = new_game()
+    moves = []
+    while game.status == "in_progress" and len(moves) < server.MAX_BATCH_MOVES:
+        move = (game.current_turn, rng.randrange(6), rng.randrange(9))
+        game.apply_moves([move])
+        moves.append(move)
+    return moves
+
+def run_individual(moves):
+    game = new_game()
+    start = time.perf_counter()
+    for player_id, row, col in moves:
+        response = client.post(f"/make_move?user_id={player_id}&room_id={game.room_id}&row={row}&col={col}")
+        assert response.status_code == 200, response.get_json()
+    return time.perf_counter() - start
+
+def run_batch(moves):
+    game = new_game()
+    body = {"moves": [{"user_id": p, "row": r, "col": c} for p, r, c in moves]}
+    start = time.perf_counter()
+    response = client.post(f"/make_moves?user_id={PLAYERS[0][0]}&room_id={game.room_id}", json=body)
+    assert response.status_code == 200, response.get_json()
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    total_moves = individual = batch = 0.0
+    for seed in range(games):
+        moves = random_moves(seed)
+        total_moves += len(moves)
+        individual += run_individual(moves)
+        batch += run_batch(moves)
+    print(f"{games} games, {int(total_moves)} moves")
+    print(f"individual /make_move: {individual * 1000:.1f} ms total, {individual / total_moves * 1e6:.1f} us/move")
+    print(f"batched /make_moves:   {batch * 1000:.1f} ms total, {batch / total_moves * 1e6:.1f} us/move")
+    print(f"speedup: {individual / batch:.1f}x")
@@ -0,0 +1,123 @@
+# Helpers shared by the web app (app.py) and the standalone bot (telegram-bot/bot.py).
+# Installed as a package by both requirements files, so each service imports it normally.
+import json
+import time
+import queue
+import logging
+import logging.handlers
+import datetime as dt
+from collections import OrderedDict
+
+# Inline query answers
+INLINE_CACHE_TIME = 300  # seconds Telegram may cache an answer on its side
+INLINE_CACHE_TTL = 300  # seconds a user's answer is reused from memory
+INLINE_CACHE_SIZE = 10000  # users kept in the answer cache
+
+# One JSON object per line; the timestamp prefix is rebuilt at most once per second
+class StructuredFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def __init__(self, tz=None):
+        super().__init__()
+        self.tz = tz
+        self.cached_second = None
+        self.cached_stamp = None
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        if second != self.cached_second:
+            self.cached_second = second
+            self.cached_stamp = dt.datetime.fromtimestamp(second, self.tz).strftime("%Y-%m-%d %H:%M:%S")
+        return f"{self.cached_stamp},{int(record.msecs):03d}"
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Caps records tagged with extra={"event": ...} per second; the count of
+# suppressed records is attached to the first record of the next second
+class EventRateLimitFilter(logging.Filter):
+    def __init__(self, limits):
+        super().__init__()
+        self.limits = limits
+        self.windows = {}  # event -> [second, emitted, suppressed]
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        limit = self.limits.get(event)
+        if limit is None:
+            return True
+        second = int(record.created)
+        window = self.windows.get(event)
+        if window is None or window[0] != second:
+            if window and window[2]:
+                record.suppressed = window[2]
+            window = self.windows[event] = [second, 0, 0]
+        if window[1] >= limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+# Hands unformatted records to the writer thread without ever blocking the caller
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, full_error=queue.Full):
+        super().__init__(log_queue)
+        self.full_error = full_error  # the Full exception raised by log_queue's queue module
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except self.full_error:
+            self.dropped += 1
+
+# Inline query results are built from a prebuilt template; only the message text varies per user
+INLINE_RESULT_TEMPLATE = {
+    "type": "article",
+    "id": "create_game",
+    "title": "Start a Chain Reaction Game",
+    "description": "Play a 6x9 Chain Reaction game with friends!",
+    "reply_markup": {
+        "inline_keyboard": [[{"text": "Waiting...", "callback_data": "creating-room"}]]
+    }
+}
+INLINE_MESSAGE_TEMPLATE = "{username} is creating a Chain Reaction game..."
+
+def build_inline_results(username):
+    return [{
+        **INLINE_RESULT_TEMPLATE,
+        "input_message_content": {
+            "message_text": INLINE_MESSAGE_TEMPLATE.format(username=username),
+            "parse_mode": "Markdown"
+        }
+    }]
+
+# Per-user inline answers with a TTL and LRU eviction, so bursts of keystrokes
+# are answered from memory
+class InlineAnswerCache:
+    def __init__(self, ttl=INLINE_CACHE_TTL, max_size=INLINE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # user_id -> (expires_at, username, results)
+
+    def get(self, user_id, username):
+        entry = self.entries.get(user_id)
+        if not entry or entry[0] < time.time() or entry[1] != username:
+            return None
+        self.entries.move_to_end(user_id)
+        return entry[2]
+
+    def put(self, user_id, username, results):
+        self.entries[user_id] = (time.time() + self.ttl, username, results)
+        self.entries.move_to_end(user_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
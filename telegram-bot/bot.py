@@ -1,5 +1,8 @@
 import os
+import queue
+import atexit
 import logging
+import logging.handlers
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, InlineQueryHandler, ChosenInlineResultHandler, ContextTypes, ApplicationBuilder
 from telegram.error import TelegramError
@@ -8,6 +11,10 @@ import requests
 import asyncio
 from aiohttp import web
 
+# Shared helpers come from the chain-common package (see requirements.txt)
+from chain_common import StructuredFormatter, EventRateLimitFilter, NonBlockingQueueHandler
+from chain_common import INLINE_CACHE_TIME, InlineAnswerCache, build_inline_results
+
 # Load environment variables
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -16,15 +23,23 @@ BACKEND_URL = os.getenv("BACKEND_URL")
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 PORT = int(os.getenv("PORT", 8443))  # Default to 8443 if PORT is not set
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# Logging pipeline settings
+LOG_QUEUE_SIZE = 10000  # records buffered for the writer thread before new ones are dropped
+LOG_RATE_LIMITS = {"start": 20, "help": 20, "inline_query": 20}  # records per second
+
+# Configure logging: formatting and writes to bot.log happen on the listener thread
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+log_formatter = StructuredFormatter()
+log_file_handler = logging.FileHandler("bot.log")
+log_file_handler.setFormatter(log_formatter)
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler, log_stream_handler, respect_handler_level=True)
+log_queue_handler = NonBlockingQueueHandler(log_queue)
+log_queue_handler.addFilter(EventRateLimitFilter(LOG_RATE_LIMITS))
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Initialize the bot
@@ -44,7 +59,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Welcome, {username}! 🎮\nStart a Chain Reaction game!",
         reply_markup=reply_markup
     )
-    logger.info(f"User {user_id} ({username}) started bot")
+    logger.info("User %s (%s) started bot", user_id, username, extra={"event": "start", "user_id": user_id})
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -65,31 +80,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "- The last player standing wins."
     )
     await update.message.reply_text(help_text, parse_mode="Markdown")
-    logger.info(f"User {user_id} ({username}) requested help")
+    logger.info("User %s (%s) requested help", user_id, username, extra={"event": "help", "user_id": user_id})
+
+inline_cache = InlineAnswerCache()
 
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.inline_query.from_user
     user_id = str(user.id)
     username = user.username or user.first_name
 
-    results = [
-        {
-            "type": "article",
-            "id": "create_game",
-            "title": "Start a Chain Reaction Game",
-            "description": "Play a 6x9 Chain Reaction game with friends!",
-            "input_message_content": {
-                "message_text": f"{username} is creating a Chain Reaction game...",
-                "parse_mode": "Markdown"
-            },
-            "reply_markup": {
-                "inline_keyboard": [[{"text": "Waiting...", "callback_data": "creating-room"}]]
-            }
-        }
-    ]
+    results = inline_cache.get(user_id, username)
+    if results is None:
+        results = build_inline_results(username)
+        inline_cache.put(user_id, username, results)
 
-    await update.inline_query.answer(results, cache_time=0)
-    logger.info(f"User {user_id} ({username}) initiated inline query")
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+    logger.info("User %s (%s) initiated inline query", user_id, username, extra={"event": "inline_query", "user_id": user_id})
 
 async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.chosen_inline_result.from_user
@@ -126,7 +132,8 @@ async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYP
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        logger.info(f"Game {room_id} created for user {user_id} ({username})")
+        logger.info("Game %s created for user %s (%s)", room_id, user_id, username,
+                    extra={"event": "create_game", "user_id": user_id, "room_id": room_id})
 
 # Add handlers
 bot_app.add_handler(CommandHandler("start", start))
@@ -144,7 +151,7 @@ async def webhook(request):
 async def set_webhook():
     try:
         await bot_app.bot.set_webhook(url=WEBHOOK_URL)
-        logger.info(f"Webhook set to {WEBHOOK_URL}")
+        logger.info("Webhook set to %s", WEBHOOK_URL)
     except TelegramError as e:
         logger.error(f"Failed to set webhook: {e}")
 
@@ -160,7 +167,7 @@ if __name__ == "__main__":
         loop.run_until_complete(set_webhook())
         
         # Start the web server
-        logger.info(f"Starting webhook server on port {PORT}")
+        logger.info("Starting webhook server on port %s", PORT)
         web.run_app(app, port=PORT)
     else:
         # Run in polling mode locally